@@ -1,21 +1,30 @@
 import os
 import sys
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-# 1) Grab the key (must be set in your environment first)
-API_KEY = # key
+from config import API_KEY, SPORT_KEY, REGIONS
+
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    max_retries=Retry(total=3, backoff_factor=0.3,
+                      status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+))
+
+# 1) The key comes from ODDS_API_KEY (must be set in your environment first, see config.py)
 
 # 2) Build the request—note the apiKey param
-url = "https://api.the-odds-api.com/v4/sports/baseball_mlb/odds/"
+url = f"https://api.the-odds-api.com/v4/sports/{SPORT_KEY}/odds/"
 params = {
     "apiKey": API_KEY,
-    "regions": "us",
+    "regions": REGIONS,
     "markets": "h2h,spreads,totals",
     "oddsFormat": "decimal",
     "dateFormat": "iso",
 }
 
-resp = requests.get(url, params=params, timeout=10)
+resp = SESSION.get(url, params=params, timeout=10)
 
 # 3) If it still errors, print the full URL for debugging
 print("Request URL:", resp.url, file=sys.stderr)
@@ -0,0 +1,12 @@
+"""
+config.py
+
+Settings shared by the odds scripts. The API key is read from the ODDS_API_KEY
+environment variable so it never lives in source; switch keys by changing the variable.
+"""
+
+import os
+
+API_KEY   = os.environ["ODDS_API_KEY"]
+SPORT_KEY = "baseball_mlb"
+REGIONS   = "us"
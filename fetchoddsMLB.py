@@ -1,20 +1,62 @@
+import asyncio
+import aiohttp
+import ijson
+import orjson
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import requests
-import csv
-from datetime import datetime, date, time, timezone
+from datetime import datetime, time, timedelta, timezone
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError
+from urllib3.util.retry import Retry
+
+from config import API_KEY, SPORT_KEY, REGIONS
+from responsecache import cache_key, get_fresh, get_stale, store
 
-API_KEY   = # insert API key here
-SPORT_KEY = "baseball_mlb"
-REGIONS   = "us"
 ODDS_FMT  = "american"
 DATE_FMT  = "iso"
 CSV_PATH  = r"PutPathHere"  # Path to output CSV
 
+CSV_FIELDS = [
+    'commence_time', 'away_team', 'home_team',
+    'bookmaker', 'market_key', 'outcome_name',
+    'player_name', 'description', 'price', 'point'
+]
+
 # The only supported markets for MLB on the main odds endpoint:
 FEATURED_MARKETS = ["h2h", "spreads", "totals"]
 
-
-def fetch_featured_odds(markets):
+# Per-event odds are fetched concurrently; cap in-flight requests for the API rate limit.
+EVENT_CONCURRENCY = 8
+
+# Seconds a cached odds response is reused before hitting the API again.
+ODDS_CACHE_TTL = 15
+
+# Statuses worth retrying, and the only ones (plus connection errors/timeouts) that fall
+# back to cached odds; other 4xx (removed game, bad or exhausted key) are real failures.
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+# Cached odds older than this are never used as a fallback; prices move quickly.
+ODDS_STALE_MAX_AGE = 10 * 60
+
+# One keep-alive session so repeat calls skip the TCP/TLS handshake. Transient
+# errors are retried; raise_on_status=False leaves the final status for raise_for_status().
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.3,
+                      status_forcelist=sorted(TRANSIENT_STATUSES), raise_on_status=False)
+))
+
+
+def fetch_featured_odds(markets, window=None):
+    """
+    Fetches featured odds, streaming the response through ijson one game at a time.
+    If window=(start_iso, end_iso) is given, games starting outside [start, end) are dropped
+    as they are parsed, so the full board is never held in memory. Both bounds must be UTC
+    "YYYY-MM-DDTHH:MM:SSZ" strings like the API's commence_time, which sort lexicographically.
+    """
     url = f"https://api.the-odds-api.com/v4/sports/{SPORT_KEY}/odds"
     params = {
         "apiKey":     API_KEY,
@@ -23,21 +65,39 @@ def fetch_featured_odds(markets):
         "oddsFormat": ODDS_FMT,
         "dateFormat": DATE_FMT
     }
+    key = cache_key(url, {**params, "window": window})
+    cached = get_fresh(key, ODDS_CACHE_TTL)
+    if cached is not None:
+        return cached
+
     try:
-        resp = requests.get(url, params=params)
+        resp = SESSION.get(url, params=params, timeout=10, stream=True)
         resp.raise_for_status()
     except HTTPError as e:
+        resp.close()
         if resp.status_code == 422:
             print("Warning: fallback to featured markets only.")
             params["markets"] = ",".join(FEATURED_MARKETS)
-            resp = requests.get(url, params=params)
+            resp = SESSION.get(url, params=params, timeout=10, stream=True)
             resp.raise_for_status()
         else:
-            raise
-    return resp.json()
+            stale = get_stale(key, max_age=ODDS_STALE_MAX_AGE)
+            if resp.status_code not in TRANSIENT_STATUSES or stale is None:
+                raise
+            print(f"Warning: {e}; using last cached featured odds.")
+            return stale
+
+    with resp:
+        resp.raw.decode_content = True
+        games = [
+            g for g in ijson.items(resp.raw, "item", use_float=True)
+            if window is None or window[0] <= g["commence_time"] < window[1]
+        ]
+    store(key, games)
+    return games
 
 
-def fetch_event_odds(event_id, extra_markets):
+async def fetch_event_odds_async(session, semaphore, event_id, extra_markets):
     url = f"https://api.the-odds-api.com/v4/sports/{SPORT_KEY}/events/{event_id}/odds"
     params = {
         "apiKey":     API_KEY,
@@ -46,128 +106,145 @@ def fetch_event_odds(event_id, extra_markets):
         "oddsFormat": ODDS_FMT,
         "dateFormat": DATE_FMT
     }
-    resp = requests.get(url, params=params)
-    resp.raise_for_status()
-    return resp.json()
-
+    key = cache_key(url, params)
+    cached = get_fresh(key, ODDS_CACHE_TTL)
+    if cached is not None:
+        return cached
 
-def write_odds_row(writer, game_info, bookmaker, market, outcome):
-    """Helper function to write a row with enhanced player information"""
-    # Extract player information for player props
-    outcome_name = outcome['name']
-    player_name = outcome.get('player_name', '')
-    description = outcome.get('description', '')
-    
-    if player_name:
-        if description and description != outcome_name:
-            full_outcome_name = f"{player_name} - {description}"
-        else:
-            full_outcome_name = f"{player_name} - {outcome_name}"
-    else:
-        full_outcome_name = outcome_name
-    
-    writer.writerow({
-        'commence_time': game_info['commence_time'],
-        'away_team': game_info['away_team'],
-        'home_team': game_info['home_team'],
-        'bookmaker': bookmaker,
-        'market_key': market,
-        'outcome_name': full_outcome_name,
-        'player_name': player_name,
-        'description': description,
-        'price': outcome['price'],
-        'point': outcome.get('point', '')  # For spreads and totals
-    })
+    try:
+        async with semaphore:
+            async with session.get(url, params=params) as resp:
+                resp.raise_for_status()
+                full = orjson.loads(await resp.read())
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        if isinstance(e, aiohttp.ClientResponseError) and e.status not in TRANSIENT_STATUSES:
+            raise
+        stale = get_stale(key, max_age=ODDS_STALE_MAX_AGE)
+        if stale is None:
+            raise
+        print(f"Warning: {e}; using last cached odds for event {event_id}.")
+        return stale
+    store(key, full)
+    return full
+
+
+async def gather_event_odds(event_ids, extra_markets):
+    """Fetch odds for every event concurrently, returned in event_ids order.
+    Failed requests come back as the raised exception instead of a result."""
+    semaphore = asyncio.Semaphore(EVENT_CONCURRENCY)
+    connector = aiohttp.TCPConnector(limit=16)
+    # No cap on the whole request: player-prop responses can run to several MB. Only a
+    # stalled connect or read (no bytes for sock_read seconds) is treated as a failure.
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        return await asyncio.gather(
+            *[fetch_event_odds_async(session, semaphore, eid, extra_markets) for eid in event_ids],
+            return_exceptions=True
+        )
+
+
+def odds_frame(games):
+    """
+    Flattens a list of games (featured or per-event responses) into one row per outcome,
+    in CSV_FIELDS order, with enhanced player information.
+    """
+    df = pd.json_normalize(
+        games,
+        record_path=["bookmakers", "markets", "outcomes"],
+        meta=["commence_time", "away_team", "home_team",
+              ["bookmakers", "key"], ["bookmakers", "title"], ["bookmakers", "markets", "key"]],
+        errors="ignore"
+    )
+    if df.empty:
+        return pd.DataFrame(columns=CSV_FIELDS)
+
+    # Outcome fields that are absent from every game (e.g. point with no spreads) still get a column
+    df = df.reindex(columns=[
+        "commence_time", "away_team", "home_team", "bookmakers.key", "bookmakers.title",
+        "bookmakers.markets.key", "name", "player_name", "description", "price", "point"
+    ])
+
+    df["bookmaker"] = df["bookmakers.title"].fillna(df["bookmakers.key"])
+    df["market_key"] = df["bookmakers.markets.key"]
+
+    # Player props: "<player> - <description>", or "<player> - <name>" when the description adds nothing.
+    # Missing player_name/description/point stay null (not "") so columns keep their types;
+    # the CSV writer renders nulls as empty cells.
+    player_name = df["player_name"].fillna("")
+    description = df["description"].fillna("")
+    detail = description.where((description != "") & (description != df["name"]), df["name"])
+    df["outcome_name"] = df["name"].where(player_name == "", player_name + " - " + detail)
+
+    return df[CSV_FIELDS]
 
 
 if __name__ == "__main__":
-    # Fetch featured odds
-    desired_markets = FEATURED_MARKETS + ["player_props"]
-    games = fetch_featured_odds(desired_markets)
-
     # Filter games for today until 11:59 PM local time
     now = datetime.now()
     today_start = datetime.combine(now.date(), time.min)  # Today at 00:00:00
     today_end = datetime.combine(now.date(), time(23, 59, 59))  # Today at 23:59:59
+    # Convert the local window to UTC ISO strings once; games are then kept by plain string compare
+    tomorrow_start = today_start + timedelta(days=1)
+    today_start_iso = today_start.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    tomorrow_start_iso = tomorrow_start.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
     
     print(f"Looking for games between {today_start} and {today_end} local time")
     
-    today_games = []
-    for g in games:
-        game_time_utc = datetime.fromisoformat(g["commence_time"].replace("Z", "+00:00"))
-        game_time_local = game_time_utc.replace(tzinfo=timezone.utc).astimezone()
-        game_time_local_naive = game_time_local.replace(tzinfo=None)
-        
-        if today_start <= game_time_local_naive <= today_end:
-            today_games.append(g)
-            print(f"Including game: {g['away_team']} @ {g['home_team']} at {game_time_local_naive}")
+    # Fetch featured odds, keeping only today's games while the response streams in
+    desired_markets = FEATURED_MARKETS + ["player_props"]
+    today_games = fetch_featured_odds(desired_markets, window=(today_start_iso, tomorrow_start_iso))
+    
+    for g in today_games:
+        game_time_local_naive = datetime.fromisoformat(g["commence_time"].replace("Z", "+00:00")).astimezone().replace(tzinfo=None)
+        print(f"Including game: {g['away_team']} @ {g['home_team']} at {game_time_local_naive}")
     
     print(f"Found {len(today_games)} games for today")
 
-    with open(CSV_PATH, mode='w', newline='', encoding='utf-8') as csvfile:
-        fieldnames = [
-            'commence_time', 'away_team', 'home_team',
-            'bookmaker', 'market_key', 'outcome_name', 
-            'player_name', 'description', 'price', 'point'
-        ]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-
-        # Write featured odds rows
-        for game in today_games:
-            game_info = {
-                'commence_time': game['commence_time'],
-                'away_team': game['away_team'],
-                'home_team': game['home_team']
-            }
-            
-            for book in game['bookmakers']:
-                bookmaker = book.get('title', book.get('key'))
-                for m in book['markets']:
-                    market = m['key']
-                    for o in m['outcomes']:
-                        write_odds_row(writer, game_info, bookmaker, market, o)
-
-        # Fetch and write additional markets
-        EXTRA_MARKETS = [
-            "batter_home_runs",
-            "batter_hits", 
-            "batter_rbis",
-            "batter_runs_scored",
-            "batter_stolen_bases",
-            "batter_singles",
-            "batter_doubles",
-            "batter_triples",
-            "batter_walks",
-            "batter_strikeouts",
-            "batter_hits_runs_rbis",
-            "pitcher_strikeouts",
-            "pitcher_hits_allowed",
-            "pitcher_walks",
-            "pitcher_earned_runs",
-            "pitcher_outs",
-            "totals_1st_5_innings",
-        ]
-        
-        for game in today_games:
-            try:
-                full = fetch_event_odds(game['id'], EXTRA_MARKETS)
-                game_info = {
-                    'commence_time': full.get('commence_time', game['commence_time']),
-                    'away_team': full.get('away_team', game['away_team']),
-                    'home_team': full.get('home_team', game['home_team'])
-                }
-                
-                for book in full['bookmakers']:
-                    bookmaker = book.get('title', book.get('key'))
-                    for m in book['markets']:
-                        market = m['key']
-                        for o in m['outcomes']:
-                            write_odds_row(writer, game_info, bookmaker, market, o)
-                            
-            except HTTPError as e:
-                print(f"Error fetching additional markets for game {game['id']}: {e}")
-                continue
+    # Fetch additional markets up front so the CSV is written in a single pass
+    EXTRA_MARKETS = [
+        "batter_home_runs",
+        "batter_hits", 
+        "batter_rbis",
+        "batter_runs_scored",
+        "batter_stolen_bases",
+        "batter_singles",
+        "batter_doubles",
+        "batter_triples",
+        "batter_walks",
+        "batter_strikeouts",
+        "batter_hits_runs_rbis",
+        "pitcher_strikeouts",
+        "pitcher_hits_allowed",
+        "pitcher_walks",
+        "pitcher_earned_runs",
+        "pitcher_outs",
+        "totals_1st_5_innings",
+    ]
+    
+    event_odds = asyncio.run(gather_event_odds([g['id'] for g in today_games], EXTRA_MARKETS))
+
+    # Event responses normally repeat the game fields; fall back to the featured game if not
+    event_games = []
+    for game, full in zip(today_games, event_odds):
+        if isinstance(full, (aiohttp.ClientError, asyncio.TimeoutError)):
+            print(f"Error fetching additional markets for game {game['id']}: {full}")
+            continue
+        if isinstance(full, BaseException):
+            raise full
+        event_games.append({
+            'commence_time': game['commence_time'],
+            'away_team': game['away_team'],
+            'home_team': game['home_team'],
+            **full
+        })
+
+    # Flatten featured + additional markets in one vectorised pass and write with Arrow's CSV writer
+    odds = odds_frame(today_games + event_games)
+    pacsv.write_csv(
+        pa.Table.from_pandas(odds, preserve_index=False),
+        CSV_PATH,
+        write_options=pacsv.WriteOptions(include_header=True, null_string="")
+    )
 
     print(f"Exported odds to CSV: {CSV_PATH}")
     print("Player names are now included in separate 'player_name' column and combined in 'outcome_name' for player props.")
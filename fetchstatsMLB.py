@@ -2,145 +2,233 @@
 """
 mlb_player_stats_bulk_all_with_team.py
 
-Uses the MLB-StatsAPI wrapper (toddrob99) to:
+Calls the MLB StatsAPI directly (asyncio + httpx, all requests overlapped) to:
   - Fetch all players’ hitting stats (for the current season) in paginated calls.
   - Fetch all players’ pitching stats (for the current season) in paginated calls.
   - Fetch all MLB teams’ hitting stats (for the current season) in one call via teams_stats.
   - Fetch all MLB teams’ pitching stats (for the current season) in one call via teams_stats.
-  - Merge player stats into a single DataFrame and save to player_stats.csv.
-  - Merge team hitting/pitching into a single team_stats.csv.
+  - Merge player stats into a single DataFrame and save to player_stats.parquet.
+  - Merge team hitting/pitching into a single team_stats.parquet.
 
-To change the output paths, edit OUTPUT_PLAYER_CSV_PATH and OUTPUT_TEAM_CSV_PATH below.
+To change the output paths, edit OUTPUT_PLAYER_PARQUET_PATH and OUTPUT_TEAM_PARQUET_PATH below.
+Parquet is the recommended format: it is several times smaller than CSV, writes faster,
+and keeps column types, so readers don't re-parse every stat from text. Set
+OUTPUT_PLAYER_CSV_PATH / OUTPUT_TEAM_CSV_PATH as well if something still needs CSV.
 """
 
-import statsapi
+import argparse
+import asyncio
+import httpx
+import orjson
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import datetime
 import os
 
+from responsecache import cache_key, get_fresh, get_stale, store
+
 # ─── EDIT THESE TO YOUR DESIRED OUTPUT FILEPATHS ───
-OUTPUT_PLAYER_CSV_PATH = r"PutPathHere"
-OUTPUT_TEAM_CSV_PATH   = r"PutPathHere"
+OUTPUT_PLAYER_PARQUET_PATH = r"PutPathHere"
+OUTPUT_TEAM_PARQUET_PATH   = r"PutPathHere"
+# Optional CSV copies of the same tables (None = don't write CSV)
+OUTPUT_PLAYER_CSV_PATH = None
+OUTPUT_TEAM_CSV_PATH   = None
 # ─────────────────────────────────────────────────────────
 
+STATSAPI_URL = "https://statsapi.mlb.com/api/v1"
+# Endpoint names (as used by the MLB-StatsAPI wrapper) -> URL path under STATSAPI_URL
+STATSAPI_PATHS = {
+    "stats": "stats",
+    "teams_stats": "teams/stats",
+}
 
-def fetch_all_hitting_stats(season_year):
-    """
-    Pulls all players' hitting stats for season_year, handling pagination.
-    Returns a DataFrame with columns: playerId, playerName, hitting_<metric>...
-    """
-    all_rows = []
-    offset = 0
-    limit = 100
-
-    while True:
-        params = {
-            "stats": "season",
-            "season": season_year,
-            "group": "hitting",
-            "playerPool": "ALL",
-            "hydrate": "person([id,name])",
-            "limit": limit,
-            "offset": offset
-        }
-        raw = statsapi.get("stats", params)
-        stats_blocks = raw.get("stats", [])
+PAGE_LIMIT = 100    # Rows per paginated "stats" request
+
+# Transient statuses retried with exponential backoff (0.3s, 0.6s, 1.2s)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 3
+
+# Seconds a cached StatsAPI response is reused: the current season changes during games,
+# completed seasons essentially never do.
+CURRENT_SEASON_CACHE_TTL = 600
+PAST_SEASON_CACHE_TTL = 24 * 3600
+
+
+def stats_cache_ttl(season_year):
+    if season_year >= datetime.date.today().year:
+        return CURRENT_SEASON_CACHE_TTL
+    return PAST_SEASON_CACHE_TTL
 
-        # If no stats returned or all splits empty, break
-        if not stats_blocks or all(len(block.get("splits", [])) == 0 for block in stats_blocks):
-            break
 
-        batch_rows = []
-        for stat_block in stats_blocks:
-            for split in stat_block.get("splits", []):
-                stat_values = split.get("stat", {})
-                player_id = split["player"]["id"]
-                player_name = split["player"]["fullName"]
-                row = {
-                    "playerId": player_id,
-                    "playerName": player_name
-                }
-                for fld, val in stat_values.items():
-                    row[f"hitting_{fld}"] = val
-                batch_rows.append(row)
-
-        if not batch_rows:
+async def _request_json(client, endpoint, params):
+    """GETs a StatsAPI endpoint, retrying RETRY_STATUSES with backoff, and decodes the JSON body."""
+    url = f"{STATSAPI_URL}/{STATSAPI_PATHS[endpoint]}"
+    for attempt in range(MAX_RETRIES + 1):
+        resp = await client.get(url, params=params)
+        if resp.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
             break
+        await asyncio.sleep(0.3 * 2 ** attempt)
+    resp.raise_for_status()
+    return orjson.loads(resp.content)
 
-        all_rows.extend(batch_rows)
+
+async def stats_get(client, endpoint, params, ttl):
+    """
+    GETs a StatsAPI endpoint through the shared client, backed by the on-disk response cache
+    keyed per endpoint and params.
+    Cached copies younger than ttl seconds are returned without a request; ttl=0 always refetches.
+    Falls back to the last cached copy on HTTP errors.
+    """
+    key = cache_key(f"statsapi:{endpoint}", params)
+    cached = get_fresh(key, ttl)
+    if cached is not None:
+        return cached
+
+    try:
+        raw = await _request_json(client, endpoint, params)
+    except httpx.HTTPStatusError as e:
+        stale = get_stale(key)
+        if stale is None:
+            raise
+        print(f"Warning: {e}; using last cached {endpoint} response.")
+        return stale
+    store(key, raw)
+    return raw
+
+
+def _page_split_count(raw):
+    return sum(len(block.get("splits", [])) for block in raw.get("stats", []))
+
+
+async def _request_pages(client, base_params):
+    limit = base_params["limit"]
+    first = await _request_json(client, "stats", {**base_params, "offset": 0})
+    n = _page_split_count(first)
+    if n == 0:
+        return []
+
+    total = first["stats"][0].get("totalSplits")
+    if total is not None:
+        rest = await asyncio.gather(*[
+            _request_json(client, "stats", {**base_params, "offset": off})
+            for off in range(limit, total, limit)
+        ])
+        return [first] + [raw for raw in rest if _page_split_count(raw)]
+
+    pages = [first]
+    offset = limit
+    # A short page is the last one, so there is no extra request just to see an empty page
+    while n >= limit:
+        raw = await _request_json(client, "stats", {**base_params, "offset": offset})
+        n = _page_split_count(raw)
+        if n == 0:
+            break
+        pages.append(raw)
         offset += limit
+    return pages
 
-    return pd.DataFrame(all_rows)
 
+async def fetch_stats_pages(client, base_params, ttl):
+    """
+    Fetches every page of a paginated "stats" query and returns the raw responses in offset order.
+    Page 0 is requested first; when it reports totalSplits the remaining offsets are requested
+    all at once, otherwise pages are requested one at a time until one comes back short of limit.
 
-def fetch_all_pitching_stats(season_year):
+    The page set is cached as one entry under base_params (no offset), so a cached or stale
+    result always comes from a single fetch: players moving between pages can't show up
+    twice or drop out. If any page fails, the whole set is served stale or the error raised.
     """
-    Pulls all players' pitching stats for season_year, handling pagination.
-    Returns a DataFrame with columns: playerId, playerName, pitching_<metric>...
+    key = cache_key("statsapi:stats:pages", base_params)
+    cached = get_fresh(key, ttl)
+    if cached is not None:
+        return cached
+
+    try:
+        pages = await _request_pages(client, base_params)
+    except httpx.HTTPStatusError as e:
+        stale = get_stale(key)
+        if stale is None:
+            raise
+        print(f"Warning: {e}; using last cached stats pages for {base_params['group']}.")
+        return stale
+    store(key, pages)
+    return pages
+
+
+def _to_numeric_stats(df, prefix):
     """
-    all_rows = []
-    offset = 0
-    limit = 100
-
-    while True:
-        params = {
-            "stats": "season",
-            "season": season_year,
-            "group": "pitching",
-            "playerPool": "ALL",
-            "hydrate": "person([id,name])",
-            "limit": limit,
-            "offset": offset
-        }
-        raw = statsapi.get("stats", params)
-        stats_blocks = raw.get("stats", [])
+    StatsAPI returns rate stats as strings (".312", "3.45"). Converts the string <prefix>_ columns
+    to float32 numbers (placeholders like "-.--" become NaN); columns that arrived as JSON
+    numbers, e.g. counts like gamesPlayed or wins, keep their integer/float dtype.
+    """
+    str_cols = [c for c in df.columns if c.startswith(prefix) and not pd.api.types.is_numeric_dtype(df[c])]
+    df[str_cols] = df[str_cols].apply(pd.to_numeric, errors="coerce", downcast="float")
+    return df
 
-        # If no stats returned or all splits empty, break
-        if not stats_blocks or all(len(block.get("splits", [])) == 0 for block in stats_blocks):
-            break
 
-        batch_rows = []
-        for stat_block in stats_blocks:
-            for split in stat_block.get("splits", []):
-                stat_values = split.get("stat", {})
-                player_id = split["player"]["id"]
-                player_name = split["player"]["fullName"]
-                row = {
-                    "playerId": player_id,
-                    "playerName": player_name
-                }
-                for fld, val in stat_values.items():
-                    row[f"pitching_{fld}"] = val
-                batch_rows.append(row)
-
-        if not batch_rows:
-            break
+def _player_pages_to_frame(pages, prefix):
+    """
+    Gathers the raw splits of every page into one list and flattens them with a single
+    pd.json_normalize call (stat.* and player.* become columns).
+    Returns a DataFrame with columns: playerId, playerName, <prefix>_<metric>...
+    """
+    splits = [
+        split
+        for raw in pages
+        for block in raw.get("stats", [])
+        for split in block.get("splits", [])
+    ]
+    if not splits:
+        return pd.DataFrame()
 
-        all_rows.extend(batch_rows)
-        offset += limit
+    df = pd.json_normalize(splits)
+    df = df.rename(columns=lambda c: f"{prefix}_{c[5:]}" if c.startswith("stat.") else c)
+    df = df.rename(columns={"player.id": "playerId", "player.fullName": "playerName"})
+    df = df[["playerId", "playerName"] + [c for c in df.columns if c.startswith(f"{prefix}_")]]
+    return _to_numeric_stats(df.astype({"playerId": "int32"}), f"{prefix}_")
+
+
+async def _fetch_all_player_stats(client, season_year, group, ttl):
+    """
+    Pulls all players' stats in group ("hitting" or "pitching") for season_year, handling pagination.
+    Returns a DataFrame with columns: playerId, playerName, <group>_<metric>...
+    """
+    base_params = {
+        "stats": "season",
+        "season": season_year,
+        "group": group,
+        "playerPool": "ALL",
+        "hydrate": "person([id,name])",
+        "limit": PAGE_LIMIT
+    }
 
-    return pd.DataFrame(all_rows)
+    pages = await fetch_stats_pages(client, base_params, ttl)
+    # Build the frame on a worker thread so the event loop keeps driving the other fetches
+    return await asyncio.to_thread(_player_pages_to_frame, pages, group)
 
 
-def fetch_all_team_hitting_stats(season_year):
+async def _fetch_all_team_stats(client, season_year, group, ttl):
     """
-    Uses the teams_stats endpoint to pull every MLB team’s hitting stats for season_year.
-    Adds "stats": "season" to satisfy the required parameters.
-    Returns a DataFrame with columns: teamId, teamName, team_hitting_<metric>...
+    Uses the teams_stats endpoint to pull every MLB team’s stats in group ("hitting" or
+    "pitching") for season_year. Adds "stats": "season" to satisfy the required parameters.
+    Returns a DataFrame with columns: teamId, teamName, team_<group>_<metric>...
     """
     params = {
         "season": season_year,
-        "group": "hitting",
+        "group": group,
         "stats": "season",
         "sportIds": 1
     }
-    raw = statsapi.get("teams_stats", params)
+    raw = await stats_get(client, "teams_stats", params, ttl)
     stats_blocks = raw.get("stats", [])
 
     # Typically stats_blocks[0]["splits"] is a list of per‐team splits
     if not stats_blocks or not stats_blocks[0].get("splits"):
         return pd.DataFrame()
 
+    prefix = f"team_{group}_"
     splits = stats_blocks[0]["splits"]
     rows = []
     for split in splits:
@@ -153,119 +241,140 @@ def fetch_all_team_hitting_stats(season_year):
             "teamName": team_name
         }
         for fld, val in stat_values.items():
-            row[f"team_hitting_{fld}"] = val
+            row[f"{prefix}{fld}"] = val
         rows.append(row)
 
-    return pd.DataFrame(rows)
+    return _to_numeric_stats(pd.DataFrame(rows), prefix)
+
 
+def prefix_cols(df, prefix):
+    """Sorted names of df's columns starting with prefix (vectorised over the column Index)."""
+    cols = df.columns
+    return cols[cols.str.startswith(prefix)].sort_values().tolist()
 
-def fetch_all_team_pitching_stats(season_year):
+
+def to_table(df, columns):
     """
-    Uses the teams_stats endpoint to pull every MLB team’s pitching stats for season_year.
-    Adds "stats": "season" to satisfy the required parameters.
-    Returns a DataFrame with columns: teamId, teamName, team_pitching_<metric>...
+    Converts df (without its index) to an Arrow table holding only columns, in that order.
+    Selecting/reordering on the Arrow table is zero-copy, unlike a pandas reindex.
     """
-    params = {
-        "season": season_year,
-        "group": "pitching",
-        "stats": "season",
-        "sportIds": 1
-    }
-    raw = statsapi.get("teams_stats", params)
-    stats_blocks = raw.get("stats", [])
+    return pa.Table.from_pandas(df, preserve_index=False).select(columns)
 
-    if not stats_blocks or not stats_blocks[0].get("splits"):
-        return pd.DataFrame()
 
-    splits = stats_blocks[0]["splits"]
-    rows = []
-    for split in splits:
-        stat_values = split.get("stat", {})
-        team_info = split.get("team", {})
-        team_id = team_info.get("id")
-        team_name = team_info.get("name")
-        row = {
-            "teamId": team_id,
-            "teamName": team_name
-        }
-        # Prefix each metric with "team_pitching_"
-        for fld, val in stat_values.items():
-            row[f"team_pitching_{fld}"] = val
-        rows.append(row)
+def require_unique_player_ids(df, group):
+    """
+    Raises ValueError naming every playerId that appears more than once in df.
+    """
+    if not df["playerId"].is_unique:
+        dupes = sorted(df.loc[df["playerId"].duplicated(), "playerId"].unique().tolist())
+        raise ValueError(f"Duplicate playerId in {group} stats: {dupes}")
 
-    return pd.DataFrame(rows)
 
+def write_csv(table, path):
+    """Writes an Arrow table through Arrow's CSV writer, which serialises whole columns in C."""
+    pacsv.write_csv(table, path, write_options=pacsv.WriteOptions(include_header=True))
 
-def main():
-    player_output_dir = os.path.dirname(OUTPUT_PLAYER_CSV_PATH)
-    team_output_dir = os.path.dirname(OUTPUT_TEAM_CSV_PATH)
-    if player_output_dir and not os.path.isdir(player_output_dir):
-        os.makedirs(player_output_dir, exist_ok=True)
-    if team_output_dir and not os.path.isdir(team_output_dir):
-        os.makedirs(team_output_dir, exist_ok=True)
 
-    current_year = datetime.date.today().year
+def write_parquet(table, path):
+    """Writes an Arrow table as zstd-compressed Parquet, keeping the column dtypes."""
+    pq.write_table(table, path, compression="zstd")
 
-    hitting_df = fetch_all_hitting_stats(current_year)
 
-    pitching_df = fetch_all_pitching_stats(current_year)
+def write_outputs(table, parquet_path, csv_path):
+    """Writes table to each configured path (None/empty skips that format); returns the paths written."""
+    written = []
+    if parquet_path:
+        write_parquet(table, parquet_path)
+        written.append(parquet_path)
+    if csv_path:
+        write_csv(table, csv_path)
+        written.append(csv_path)
+    return written
 
-    merged_players = pd.merge(
-        hitting_df,
-        pitching_df,
-        on="playerId",
-        how="outer",
-        suffixes=("_hit", "_pit"),
-        copy=False
-    )
 
-    if "playerName_hit" in merged_players.columns or "playerName_pit" in merged_players.columns:
-        merged_players["playerName"] = (
-            merged_players.get("playerName_hit", pd.Series(dtype="object"))
-                          .fillna(merged_players.get("playerName_pit", pd.Series(dtype="object")))
-        )
-        merged_players.drop(
-            columns=[c for c in ["playerName_hit", "playerName_pit"]
-                     if c in merged_players.columns],
-            inplace=True
-        )
-    elif "playerName" not in merged_players.columns:
-        hit_map = hitting_df.set_index("playerId")["playerName"].to_dict() if "playerName" in hitting_df.columns else {}
-        pit_map = pitching_df.set_index("playerId")["playerName"].to_dict() if "playerName" in pitching_df.columns else {}
-        merged_players["playerName"] = merged_players["playerId"].map(hit_map).fillna(
-            merged_players["playerId"].map(pit_map)
+async def fetch_all_stats(season_year, use_cache=True):
+    """
+    Runs the four top-level fetches concurrently over one pooled HTTP/2 client, so every
+    page shares the same kept-alive connections instead of paying a TLS handshake each.
+    With use_cache=False every request goes to the API (responses are still cached for next time).
+    Returns (hitting_df, pitching_df, team_hitting_df, team_pitching_df).
+    """
+    ttl = stats_cache_ttl(season_year) if use_cache else 0
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=MAX_RETRIES,  # connection failures; bad statuses are retried in stats_get
+        limits=httpx.Limits(max_connections=16, max_keepalive_connections=16, keepalive_expiry=30)
+    )
+    async with httpx.AsyncClient(transport=transport, timeout=30) as client:
+        return await asyncio.gather(
+            _fetch_all_player_stats(client, season_year, "hitting", ttl),
+            _fetch_all_player_stats(client, season_year, "pitching", ttl),
+            _fetch_all_team_stats(client, season_year, "hitting", ttl),
+            _fetch_all_team_stats(client, season_year, "pitching", ttl)
         )
 
-    cols = ["playerId"]
-    if "playerName" in merged_players.columns:
-        cols.append("playerName")
-    hitting_cols = sorted([c for c in merged_players.columns if c.startswith("hitting_")])
-    pitching_cols = sorted([c for c in merged_players.columns if c.startswith("pitching_")])
-    cols += hitting_cols + pitching_cols
-    merged_players = merged_players[[c for c in cols if c in merged_players.columns]]
 
-    merged_players.to_csv(OUTPUT_PLAYER_CSV_PATH, index=False)
+def main():
+    parser = argparse.ArgumentParser(description="Export MLB player and team season stats to Parquet (and optionally CSV).")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="ignore cached StatsAPI responses and refetch everything")
+    args = parser.parse_args()
 
-    team_hitting_df = fetch_all_team_hitting_stats(current_year)
+    for output_path in (OUTPUT_PLAYER_PARQUET_PATH, OUTPUT_TEAM_PARQUET_PATH,
+                        OUTPUT_PLAYER_CSV_PATH, OUTPUT_TEAM_CSV_PATH):
+        output_dir = os.path.dirname(output_path) if output_path else ""
+        if output_dir and not os.path.isdir(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
 
-    team_pitching_df = fetch_all_team_pitching_stats(current_year)
+    current_year = datetime.date.today().year
 
+    hitting_df, pitching_df, team_hitting_df, team_pitching_df = asyncio.run(
+        fetch_all_stats(current_year, use_cache=not args.no_cache)
+    )
+
+    # Hitting and pitching columns are disjoint by prefix and playerId is unique on each
+    # side (checked up front, like merge's validate="one_to_one"), so the outer join is an
+    # index-aligned concat with no suffixed columns. Names come from the hitting side and
+    # fall back to pitching for pitcher-only rows.
+    require_unique_player_ids(hitting_df, "hitting")
+    require_unique_player_ids(pitching_df, "pitching")
+    hitting_df = hitting_df.set_index("playerId")
+    pitching_df = pitching_df.set_index("playerId")
+    player_names = hitting_df.pop("playerName").combine_first(pitching_df.pop("playerName"))
+    merged_players = pd.concat(
+        [player_names, hitting_df, pitching_df],
+        axis=1
+    )
+    merged_players = merged_players.rename_axis("playerId").reset_index()
+
+    hitting_cols = prefix_cols(merged_players, "hitting_")
+    pitching_cols = prefix_cols(merged_players, "pitching_")
+    player_cols = ["playerId", "playerName", *hitting_cols, *pitching_cols]
+
+    write_outputs(to_table(merged_players, player_cols), OUTPUT_PLAYER_PARQUET_PATH, OUTPUT_PLAYER_CSV_PATH)
+
+    # teamId alone is the key (validate enforces one row per team on each side), so the
+    # merge only hashes ints. teamName comes from the pitching side and falls back to the
+    # hitting side for teams that only have hitting stats.
     merged_teams = pd.merge(
-        team_hitting_df,
+        team_hitting_df.drop(columns=["teamName"]),
         team_pitching_df,
-        on=["teamId", "teamName"],
+        on="teamId",
         how="outer",
-        copy=False
+        validate="one_to_one"
+    )
+    hitting_team_names = team_hitting_df.set_index("teamId")["teamName"]
+    merged_teams["teamName"] = merged_teams["teamName"].combine_first(
+        merged_teams["teamId"].map(hitting_team_names)
     )
 
     team_cols = ["teamId", "teamName"]
-    hitting_cols = sorted([c for c in merged_teams.columns if c.startswith("team_hitting_")])
-    pitching_cols = sorted([c for c in merged_teams.columns if c.startswith("team_pitching_")])
+    hitting_cols = prefix_cols(merged_teams, "team_hitting_")
+    pitching_cols = prefix_cols(merged_teams, "team_pitching_")
     team_cols += hitting_cols + pitching_cols
-    merged_teams = merged_teams[[c for c in team_cols if c in merged_teams.columns]]
 
-    merged_teams.to_csv(OUTPUT_TEAM_CSV_PATH, index=False)
-    print(f"\nWrote {len(merged_teams)} team rows to:\n  {OUTPUT_TEAM_CSV_PATH}")
+    team_paths = write_outputs(to_table(merged_teams, team_cols), OUTPUT_TEAM_PARQUET_PATH, OUTPUT_TEAM_CSV_PATH)
+    print(f"\nWrote {len(merged_teams)} team rows to:\n  " + "\n  ".join(team_paths))
 
 
 if __name__ == "__main__":
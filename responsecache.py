@@ -0,0 +1,58 @@
+"""
+responsecache.py
+
+On-disk cache for idempotent GET responses, shared by the fetch scripts.
+
+Entries are keyed by a hash of (url, params) and stored together with the time they
+were fetched, so each caller picks its own TTL and can still fall back to the last
+good (stale) copy when the API errors.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import diskcache
+
+CACHE_DIR = os.path.expanduser("~/.cache/oddsfetcher")
+CACHE = diskcache.Cache(CACHE_DIR, size_limit=10 * 2**30)
+
+
+def cache_key(url, params):
+    """
+    Stable key for a GET of url with params (param order does not matter).
+    apiKey is left out so rotating keys, or sharing the cache, still hits the same entries.
+    """
+    keyed_params = sorted((k, v) for k, v in params.items() if k != "apiKey")
+    raw = json.dumps([url, keyed_params], default=str)
+    return hashlib.blake2b(raw.encode()).hexdigest()
+
+
+def get_fresh(key, ttl):
+    """Cached body for key if it was stored less than ttl seconds ago, else None (always None for ttl <= 0)."""
+    entry = CACHE.get(key)
+    if entry is None:
+        return None
+    fetched_at, body = entry
+    if time.time() - fetched_at >= ttl:
+        return None
+    return body
+
+
+def get_stale(key, max_age=None):
+    """
+    Last cached body for key, or None if never cached. With max_age (seconds), entries older
+    than that are ignored too; without it any age is returned.
+    """
+    entry = CACHE.get(key)
+    if entry is None:
+        return None
+    fetched_at, body = entry
+    if max_age is not None and time.time() - fetched_at > max_age:
+        return None
+    return body
+
+
+def store(key, body):
+    CACHE.set(key, (time.time(), body))